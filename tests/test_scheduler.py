@@ -0,0 +1,214 @@
+"""Tests for synthesis scheduler (no TTS model required)"""
+import asyncio
+import threading
+import typing
+
+import pytest
+
+from tts_web.scheduler import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    DeadlineExceeded,
+    SynthesisScheduler,
+)
+
+# Upper bound on waits, only reached if a test is broken
+_TIMEOUT = 10
+
+
+class FakeSynthesizer:
+    """Records lines, optionally blocking each one until released by the test"""
+
+    def __init__(self, blocking: bool = False):
+        self.blocking = blocking
+        self.lines: typing.List[str] = []
+        self.current: typing.Optional[str] = None
+        self._gate = threading.Semaphore(0)
+
+    def __call__(self, line: str) -> bytes:
+        self.current = line
+        if self.blocking:
+            assert self._gate.acquire(timeout=_TIMEOUT), "Line never released"
+
+        self.lines.append(line)
+        self.current = None
+        return line.encode()
+
+    def release(self, count: int = 1):
+        """Let count lines finish"""
+        for _ in range(count):
+            self._gate.release()
+
+    async def wait_for_line(self, line: str):
+        """Wait until line is being synthesized"""
+        for _ in range(_TIMEOUT * 100):
+            if self.current == line:
+                return
+
+            await asyncio.sleep(0.01)
+
+        raise AssertionError(f"{line} never started")
+
+
+# -----------------------------------------------------------------------------
+
+
+def test_interactive_preempts_running_bulk():
+    """Interactive job runs between lines of an already running bulk job"""
+
+    async def test():
+        synth = FakeSynthesizer(blocking=True)
+        scheduler = SynthesisScheduler(synth)
+        scheduler.start()
+
+        bulk = asyncio.ensure_future(
+            scheduler.submit([f"b{i}" for i in range(6)], PRIORITY_BULK)
+        )
+        await synth.wait_for_line("b0")
+
+        interactive = asyncio.ensure_future(
+            scheduler.submit(["i0"], PRIORITY_INTERACTIVE)
+        )
+        await asyncio.sleep(0)
+
+        synth.release(7)
+        assert await interactive == [b"i0"]
+        assert await bulk == [f"b{i}".encode() for i in range(6)]
+
+        # Only the bulk line in progress finished before the interactive one
+        assert synth.lines == ["b0", "i0", "b1", "b2", "b3", "b4", "b5"]
+        await scheduler.stop()
+
+    asyncio.run(test())
+
+
+def test_deadline_orders_within_class():
+    """Earlier deadline goes first, no deadline is not last forever"""
+
+    async def test():
+        synth = FakeSynthesizer()
+        scheduler = SynthesisScheduler(synth, default_deadline=10)
+
+        far = asyncio.ensure_future(scheduler.submit(["far"], timeout=1e9))
+        none = asyncio.ensure_future(scheduler.submit(["none"]))
+        soon = asyncio.ensure_future(scheduler.submit(["soon"], timeout=5))
+        await asyncio.sleep(0)
+
+        scheduler.start()
+        await asyncio.gather(far, none, soon)
+        assert synth.lines == ["soon", "none", "far"]
+        await scheduler.stop()
+
+    asyncio.run(test())
+
+
+def test_bulk_not_starved():
+    """Bulk gets a share of lines while interactive work keeps coming"""
+
+    async def test():
+        synth = FakeSynthesizer()
+        scheduler = SynthesisScheduler(synth, bulk_every=3)
+
+        bulk = asyncio.ensure_future(scheduler.submit(["b0", "b1"], PRIORITY_BULK))
+        interactive = [
+            asyncio.ensure_future(scheduler.submit([f"i{i}"], PRIORITY_INTERACTIVE))
+            for i in range(6)
+        ]
+        await asyncio.sleep(0)
+
+        scheduler.start()
+        await asyncio.gather(bulk, *interactive)
+        assert synth.lines == ["i0", "i1", "b0", "i2", "i3", "b1", "i4", "i5"]
+        await scheduler.stop()
+
+    asyncio.run(test())
+
+
+def test_cancel_between_lines():
+    """Cancelled job stops after the line in progress"""
+
+    async def test():
+        synth = FakeSynthesizer(blocking=True)
+        scheduler = SynthesisScheduler(synth)
+        scheduler.start()
+
+        job = asyncio.ensure_future(scheduler.submit([f"b{i}" for i in range(6)]))
+        await synth.wait_for_line("b0")
+        synth.release()
+        await synth.wait_for_line("b1")
+        job.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await job
+
+        # Next job runs right after the cancelled job's line in progress
+        synth.release(2)
+        assert await scheduler.submit(["after"]) == [b"after"]
+        assert synth.lines == ["b0", "b1", "after"]
+
+        stats = scheduler.stats[PRIORITY_BULK]
+        assert stats.cancelled == 1
+        assert stats.failed == 0
+        await scheduler.stop()
+
+    asyncio.run(test())
+
+
+def test_deadline_expires_while_queued():
+    """Deadline is enforced while waiting, not when the job is dequeued"""
+
+    async def test():
+        synth = FakeSynthesizer(blocking=True)
+        scheduler = SynthesisScheduler(synth)
+        scheduler.start()
+
+        long_job = asyncio.ensure_future(
+            scheduler.submit([f"i{i}" for i in range(6)], PRIORITY_INTERACTIVE)
+        )
+        await synth.wait_for_line("i0")
+
+        # Worker is stuck on i0, so only the timer can expire this job
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.submit(["late"], PRIORITY_BULK, timeout=0.1)
+
+        synth.release(6)
+        await long_job
+        assert "late" not in synth.lines
+
+        stats = scheduler.get_stats()[PRIORITY_BULK]
+        assert stats["expired"] == 1
+        assert stats["started"] == 0
+        assert stats["max_wait"] > 0
+        await scheduler.stop()
+
+    asyncio.run(test())
+
+
+def test_stop_during_line():
+    """Stopping mid-line returns, cancels waiting jobs, and can be restarted"""
+
+    async def test():
+        synth = FakeSynthesizer(blocking=True)
+        scheduler = SynthesisScheduler(synth)
+        scheduler.start()
+
+        running = asyncio.ensure_future(scheduler.submit(["r0", "r1"]))
+        queued = asyncio.ensure_future(scheduler.submit(["q0"]))
+        await synth.wait_for_line("r0")
+
+        await asyncio.wait_for(scheduler.stop(), timeout=_TIMEOUT)
+
+        for job in (running, queued):
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(job, timeout=_TIMEOUT)
+
+        assert scheduler.stats[PRIORITY_BULK].failed == 0
+
+        # Let abandoned line finish, then restart
+        synth.release()
+        scheduler.start()
+        synth.release()
+        assert await scheduler.submit(["again"]) == [b"again"]
+        await scheduler.stop()
+
+    asyncio.run(test())
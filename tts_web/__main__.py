@@ -5,9 +5,9 @@ import asyncio
 import hashlib
 import io
 import logging
+import math
 import signal
 import sys
-import time
 import typing
 import uuid
 import wave
@@ -16,10 +16,18 @@ from urllib.parse import parse_qs
 
 import hypercorn
 import quart_cors
-from quart import Quart, Response, render_template, request, send_from_directory
+from quart import (
+    Quart,
+    Response,
+    jsonify,
+    render_template,
+    request,
+    send_from_directory,
+)
 
 import TTS
 
+from .scheduler import DeadlineExceeded, SynthesisScheduler, get_priority
 from .synthesize import Synthesizer
 
 sys.modules["mozilla_voice_tts"] = TTS
@@ -32,7 +40,9 @@ _LOOP = asyncio.get_event_loop()
 
 
 def get_app(
-    synthesizer: Synthesizer, cache_dir: typing.Optional[typing.Union[str, Path]] = None
+    synthesizer: Synthesizer,
+    cache_dir: typing.Optional[typing.Union[str, Path]] = None,
+    interactive_max_chars: int = 100,
 ):
     """Create Quart app and endpoints"""
     sample_rate = synthesizer.sample_rate
@@ -41,7 +51,22 @@ def get_app(
         cache_dir = Path(cache_dir)
         cache_dir.mkdir(parents=True, exist_ok=True)
 
-    def text_to_wav(text: str, lines_are_sentences: bool = True) -> bytes:
+    def synthesize_line(line: str) -> bytes:
+        """Synthesize a single line (runs in scheduler's worker thread)"""
+        _LOGGER.debug("Synthesizing line (%s char(s))", len(line))
+        line_wav_bytes = synthesizer.synthesize(line)
+        _LOGGER.debug("Got %s WAV byte(s) for line", len(line_wav_bytes))
+
+        return line_wav_bytes
+
+    scheduler = SynthesisScheduler(synthesize_line, loop=_LOOP)
+
+    async def text_to_wav(
+        text: str,
+        lines_are_sentences: bool = True,
+        priority: typing.Optional[str] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> bytes:
         _LOGGER.debug("Text: %s", text)
 
         wav_bytes: typing.Optional[bytes] = None
@@ -58,8 +83,10 @@ def get_app(
                 wav_bytes = cached_wav_path.read_bytes()
 
         if not wav_bytes:
-            _LOGGER.info("Synthesizing (%s char(s))...", len(text))
-            start_time = time.time()
+            priority = get_priority(
+                text, priority, interactive_max_chars=interactive_max_chars
+            )
+            _LOGGER.info("Synthesizing (%s char(s), %s)...", len(text), priority)
 
             if lines_are_sentences:
                 # Each line will be synthesized separately
@@ -68,7 +95,15 @@ def get_app(
                 # Entire text will be synthesized as one utterance
                 lines = [text]
 
-            # Synthesize each line separately.
+            # Skip blank lines
+            lines = [line.strip() for line in lines if line.strip()]
+
+            # Wait in line with other requests.
+            # Timing of queue wait and synthesis is logged by the scheduler.
+            line_wavs = await scheduler.submit(
+                lines, priority=priority, timeout=timeout
+            )
+
             # Accumulate into a single WAV file.
             with io.BytesIO() as wav_io:
                 with wave.open(wav_io, "wb") as wav_file:
@@ -76,24 +111,7 @@ def get_app(
                     wav_file.setsampwidth(2)
                     wav_file.setnchannels(1)
 
-                    for line_index, line in enumerate(lines):
-                        line = line.strip()
-                        if not line:
-                            # Skip blank lines
-                            continue
-
-                        _LOGGER.debug(
-                            "Synthesizing line %s (%s char(s))",
-                            line_index + 1,
-                            len(line),
-                        )
-                        line_wav_bytes = synthesizer.synthesize(line)
-                        _LOGGER.debug(
-                            "Got %s WAV byte(s) for line %s",
-                            len(line_wav_bytes),
-                            line_index + 1,
-                        )
-
+                    for line_wav_bytes in line_wavs:
                         # Open up and add to main WAV
                         with io.BytesIO(line_wav_bytes) as line_wav_io:
                             with wave.open(line_wav_io) as line_wav_file:
@@ -103,13 +121,7 @@ def get_app(
 
                 wav_bytes = wav_io.getvalue()
 
-            end_time = time.time()
-
-            _LOGGER.debug(
-                "Synthesized %s byte(s) in %s second(s)",
-                len(wav_bytes),
-                end_time - start_time,
-            )
+            _LOGGER.debug("Synthesized %s byte(s)", len(wav_bytes))
 
             # Save to cache
             if cached_wav_path:
@@ -117,12 +129,44 @@ def get_app(
 
         return wav_bytes
 
+    async def respond_wav(text: str, **kwargs) -> Response:
+        """Synthesize text using scheduling hints from request headers"""
+        priority = request.headers.get("X-TTS-Priority")
+        timeout: typing.Optional[float] = None
+
+        deadline_str = request.headers.get("X-TTS-Deadline")
+        if deadline_str:
+            try:
+                timeout = float(deadline_str)
+            except ValueError:
+                timeout = None
+
+            if (timeout is None) or (not math.isfinite(timeout)) or (timeout <= 0):
+                return Response(f"Invalid X-TTS-Deadline: {deadline_str}", status=400)
+
+        try:
+            wav_bytes = await text_to_wav(
+                text, priority=priority, timeout=timeout, **kwargs
+            )
+        except DeadlineExceeded:
+            return Response("Deadline exceeded", status=504)
+
+        return Response(wav_bytes, mimetype="audio/wav")
+
     # -------------------------------------------------------------------------
 
     app = Quart("mozillatts", template_folder=str(_DIR / "templates"))
     app.secret_key = str(uuid.uuid4())
     app = quart_cors.cors(app)
 
+    @app.before_serving
+    async def start_scheduler():
+        scheduler.start()
+
+    @app.after_serving
+    async def stop_scheduler():
+        await scheduler.stop()
+
     @app.route("/")
     async def app_index():
         return await render_template(
@@ -146,10 +190,10 @@ def get_app(
         return await send_from_directory(img_dir, filename)
 
     @app.route("/api/tts", methods=["GET", "POST"])
-    def api_tts():
+    async def api_tts():
         """Text to speech endpoint"""
         if request.method == "POST":
-            text = request.data.decode()
+            text = (await request.data).decode()
         else:
             text = request.args.get("text")
 
@@ -157,29 +201,30 @@ def get_app(
             request.args.get("linesAreSentences", "true").strip().lower() == "true"
         )
 
-        wav_bytes = text_to_wav(text, lines_are_sentences=lines_are_sentences)
-
-        return Response(wav_bytes, mimetype="audio/wav")
+        return await respond_wav(text, lines_are_sentences=lines_are_sentences)
 
     # MaryTTS compatibility layer
     @app.route("/process", methods=["GET", "POST"])
-    def api_process():
+    async def api_process():
         """MaryTTS-compatible /process endpoint"""
         if request.method == "POST":
-            data = parse_qs(request.get_data(as_text=True))
+            data = parse_qs(await request.get_data(as_text=True))
             text = data.get("INPUT_TEXT", [""])[0]
         else:
             text = request.args.get("INPUT_TEXT", "")
 
-        wav_bytes = text_to_wav(text)
-
-        return Response(wav_bytes, mimetype="audio/wav")
+        return await respond_wav(text)
 
     @app.route("/voices", methods=["GET"])
     def api_voices():
         """MaryTTS-compatible /voices endpoint"""
         return "default\n"
 
+    @app.route("/api/stats", methods=["GET"])
+    async def api_stats():
+        """Queue statistics per priority class"""
+        return jsonify(scheduler.get_stats())
+
     return app
 
 
@@ -216,6 +261,12 @@ def main():
     parser.add_argument(
         "--cache-dir", help="Path to directory to cache WAV files (default: no cache)"
     )
+    parser.add_argument(
+        "--interactive-max-chars",
+        type=int,
+        default=100,
+        help="Texts up to this length are prioritized as interactive (default: 100)",
+    )
     parser.add_argument(
         "--debug", action="store_true", help="Show DEBUG messages in the console"
     )
@@ -295,7 +346,11 @@ def main():
     synthesizer.load()
 
     # Create Quart web app
-    app = get_app(synthesizer, cache_dir=args.cache_dir)
+    app = get_app(
+        synthesizer,
+        cache_dir=args.cache_dir,
+        interactive_max_chars=args.interactive_max_chars,
+    )
 
     # -------------------------------------------------------------------------
 
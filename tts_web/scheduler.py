@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""Priority/deadline-aware scheduling of synthesis jobs"""
+import asyncio
+import heapq
+import itertools
+import logging
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+_LOGGER = logging.getLogger("mozillatts")
+
+# -----------------------------------------------------------------------------
+
+# Priority classes, most urgent first
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITY_CLASSES = [PRIORITY_INTERACTIVE, PRIORITY_BULK]
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a job's deadline passes before it finishes."""
+
+
+@dataclass
+class SynthesisJob:
+    """Lines of text waiting to be synthesized, one WAV per line."""
+
+    lines: typing.List[str]
+    priority: str
+    future: asyncio.Future
+    enqueue_time: float
+    sort_key: typing.Tuple[float, int]
+    line_index: int = 0
+    results: typing.List[bytes] = field(default_factory=list)
+    wait_time: typing.Optional[float] = None
+    synthesis_time: float = 0.0
+
+
+@dataclass
+class PriorityStats:
+    """Queue statistics for a single priority class."""
+
+    waited: int = 0
+    started: int = 0
+    completed: int = 0
+    cancelled: int = 0
+    expired: int = 0
+    failed: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def add_wait(self, wait_time: float):
+        """Record time a job spent in the queue before starting or giving up"""
+        self.waited += 1
+        self.total_wait += wait_time
+        self.max_wait = max(self.max_wait, wait_time)
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        """Convert to JSON-friendly dict"""
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "expired": self.expired,
+            "failed": self.failed,
+            "mean_wait": (self.total_wait / self.waited) if self.waited else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+# -----------------------------------------------------------------------------
+
+
+def get_priority(
+    text: str,
+    priority: typing.Optional[str] = None,
+    interactive_max_chars: int = 100,
+) -> str:
+    """Determine priority class from explicit value or text length"""
+    if priority:
+        priority = priority.strip().lower()
+        if priority in PRIORITY_CLASSES:
+            return priority
+
+        _LOGGER.warning("Unknown priority class: %s", priority)
+
+    if len(text) <= interactive_max_chars:
+        return PRIORITY_INTERACTIVE
+
+    return PRIORITY_BULK
+
+
+class SynthesisScheduler:
+    """Synthesizes lines one at a time, most urgent first.
+
+    After every line, the next line is picked again from the queues, so a
+    long bulk job never blocks interactive work for more than one line.
+
+    Within a class, jobs are ordered by deadline. Jobs without a deadline are
+    ordered as if their deadline were default_deadline seconds after arrival,
+    so a far-off deadline can't be used to jump ahead.
+
+    While bulk work is waiting, at least one in every bulk_every lines goes to
+    bulk so that a steady stream of interactive requests can't starve it.
+    """
+
+    def __init__(
+        self,
+        synthesize_line: typing.Callable[[str], bytes],
+        loop: typing.Optional[asyncio.AbstractEventLoop] = None,
+        default_deadline: float = 60.0,
+        bulk_every: int = 5,
+    ):
+        self.synthesize_line = synthesize_line
+        self.loop = loop or asyncio.get_event_loop()
+        self.default_deadline = default_deadline
+        self.bulk_every = bulk_every
+        self.stats: typing.Dict[str, PriorityStats] = {
+            priority: PriorityStats() for priority in PRIORITY_CLASSES
+        }
+
+        # Heap of (deadline, arrival order, job) for each priority class
+        self._queues: typing.Dict[
+            str, typing.List[typing.Tuple[float, int, SynthesisJob]]
+        ] = {priority: [] for priority in PRIORITY_CLASSES}
+        self._counter = itertools.count()
+        self._ready = asyncio.Event()
+
+        # Lines synthesized in a row while bulk work was waiting
+        self._bulk_skipped = 0
+
+        # Created in start(). Model is not safe to use from multiple threads.
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+        self._worker_task: typing.Optional[asyncio.Future] = None
+
+        # Job with a line currently being synthesized
+        self._current_job: typing.Optional[SynthesisJob] = None
+
+    def start(self):
+        """Start background worker (again, if stopped)"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+        if self._worker_task is None:
+            self._worker_task = self.loop.create_task(self._worker())
+
+    async def stop(self):
+        """Stop background worker and cancel all queued/running jobs.
+
+        A line in progress is not interrupted, but its result is discarded.
+        """
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+
+            self._worker_task = None
+
+        jobs = [job for queue in self._queues.values() for _, _, job in queue]
+        if self._current_job is not None:
+            jobs.append(self._current_job)
+            self._current_job = None
+
+        for queue in self._queues.values():
+            queue.clear()
+
+        for job in jobs:
+            if not job.future.done():
+                job.future.cancel()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def submit(
+        self,
+        lines: typing.List[str],
+        priority: str = PRIORITY_BULK,
+        timeout: typing.Optional[float] = None,
+    ) -> typing.List[bytes]:
+        """Queue lines for synthesis and wait for one WAV per line.
+
+        Cancelling the awaiting task (e.g., client disconnect) cancels the job
+        before its next line. DeadlineExceeded is raised once timeout seconds
+        have passed, whether the job is queued or partially synthesized.
+        """
+        if not lines:
+            return []
+
+        enqueue_time = self.loop.time()
+        if timeout is None:
+            sort_deadline = enqueue_time + self.default_deadline
+        else:
+            sort_deadline = enqueue_time + timeout
+
+        job = SynthesisJob(
+            lines=lines,
+            priority=priority,
+            future=self.loop.create_future(),
+            enqueue_time=enqueue_time,
+            sort_key=(sort_deadline, next(self._counter)),
+        )
+        self._push(job)
+        _LOGGER.debug("Queued %s job (%s line(s))", priority, len(lines))
+
+        timer: typing.Optional[asyncio.TimerHandle] = None
+        if timeout is not None:
+            timer = self.loop.call_later(timeout, self._expire, job)
+
+        stats = self.stats[priority]
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            _LOGGER.debug("Cancelling %s job", priority)
+            stats.cancelled += 1
+            self._record_wait(job)
+            raise
+        except DeadlineExceeded:
+            _LOGGER.debug("Deadline exceeded for %s job", priority)
+            stats.expired += 1
+            self._record_wait(job)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def get_stats(self) -> typing.Dict[str, typing.Any]:
+        """Per-class queue statistics"""
+        return {
+            priority: {
+                "queued": sum(
+                    1 for _, _, job in self._queues[priority] if not job.future.done()
+                ),
+                **stats.to_dict(),
+            }
+            for priority, stats in self.stats.items()
+        }
+
+    # -------------------------------------------------------------------------
+
+    async def _worker(self):
+        """Synthesize queued lines one at a time"""
+        while True:
+            job = self._pop()
+            if job is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            if job.future.done():
+                # Cancelled or expired (already counted)
+                continue
+
+            stats = self.stats[job.priority]
+            if job.wait_time is None:
+                self._record_wait(job)
+                stats.started += 1
+                _LOGGER.debug(
+                    "Starting %s job after %s second(s) in queue",
+                    job.priority,
+                    job.wait_time,
+                )
+
+            line = job.lines[job.line_index]
+            start_time = self.loop.time()
+            self._current_job = job
+            try:
+                line_wav_bytes = await self.loop.run_in_executor(
+                    self._executor, self.synthesize_line, line
+                )
+            except asyncio.CancelledError:
+                # Subclass of Exception before Python 3.8.
+                # Leave current job for stop() to cancel.
+                raise
+            except Exception as e:
+                _LOGGER.exception("synthesize_line")
+                self._current_job = None
+                if not job.future.done():
+                    stats.failed += 1
+                    job.future.set_exception(e)
+
+                continue
+
+            self._current_job = None
+
+            job.synthesis_time += self.loop.time() - start_time
+            job.results.append(line_wav_bytes)
+            job.line_index += 1
+
+            if job.future.done():
+                # Cancelled or expired during this line
+                continue
+
+            if job.line_index < len(job.lines):
+                # Back in line with its original position
+                self._push(job)
+            else:
+                stats.completed += 1
+                _LOGGER.debug(
+                    "Finished %s job: %s second(s) in queue, %s second(s) synthesizing",
+                    job.priority,
+                    job.wait_time,
+                    job.synthesis_time,
+                )
+                job.future.set_result(job.results)
+
+    def _push(self, job: SynthesisJob):
+        heapq.heappush(self._queues[job.priority], (*job.sort_key, job))
+        self._ready.set()
+
+    def _pop(self) -> typing.Optional[SynthesisJob]:
+        """Take the next job to synthesize a line for"""
+        interactive = self._queues[PRIORITY_INTERACTIVE]
+        bulk = self._queues[PRIORITY_BULK]
+
+        for queue in (interactive, bulk):
+            # Drop cancelled/expired jobs from the front
+            while queue and queue[0][-1].future.done():
+                heapq.heappop(queue)
+
+        if not bulk:
+            self._bulk_skipped = 0
+            if interactive:
+                return heapq.heappop(interactive)[-1]
+
+            return None
+
+        if interactive and (self._bulk_skipped < (self.bulk_every - 1)):
+            self._bulk_skipped += 1
+            return heapq.heappop(interactive)[-1]
+
+        self._bulk_skipped = 0
+        return heapq.heappop(bulk)[-1]
+
+    def _expire(self, job: SynthesisJob):
+        if not job.future.done():
+            job.future.set_exception(DeadlineExceeded())
+
+    def _record_wait(self, job: SynthesisJob):
+        """Record queue wait once, when a job starts or gives up while queued"""
+        if job.wait_time is None:
+            job.wait_time = self.loop.time() - job.enqueue_time
+            self.stats[job.priority].add_wait(job.wait_time)